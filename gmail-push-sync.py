@@ -6,14 +6,27 @@ Uses Gmail API + Pub/Sub for real-time notifications
 
 import os
 import json
+import base64
+import imaplib
 import logging
 import threading
 import time
+import queue
+import signal
+import collections
+import re
+from email.parser import BytesHeaderParser
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
+import google_auth_httplib2
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
 import subprocess
 
 # Configure logging
@@ -27,40 +40,124 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Maximum number of calls Gmail accepts in a single batch HTTP request
+GMAIL_BATCH_SIZE = 100
+# Maximum number of IDs in one messages.batchModify call
+GMAIL_MODIFY_BATCH_SIZE = 1000
+
+# Attempts per message before it is left to the periodic imapsync reconcile
+MAX_MESSAGE_ATTEMPTS = 3
+
+# Gmail API rate limiting: retry these statuses with exponential backoff
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+MIN_BACKOFF_DELAY = 1.0
+MAX_BACKOFF_DELAY = 64.0
+MAX_BACKOFF_ATTEMPTS = 7  # 1+2+4+...+64s, about two minutes before giving up
+
+# Gmail push payloads are a fixed {"emailAddress": ..., "historyId": ...} object;
+# historyId is the only field used, so it is matched straight from the raw bytes
+HISTORY_ID_RE = re.compile(rb'"historyId"\s*:\s*"?(\d+)')
+
+@dataclass(frozen=True, slots=True)
+class SyncConfig:
+    """Service configuration, resolved from the environment at startup"""
+    project_id: str
+    subscription_name: str
+    topic_name: str
+    credentials_file: str
+    token_file: str
+
+    # Gmail IMAP credentials (used by the imapsync reconcile)
+    user1: str
+    password1: str
+
+    # Destination IMAP settings
+    host2: str
+    user2: str
+    password2: str
+    ssl2: bool
+    folder: str
+    move: bool
+    reconcile_interval: int
+    dest_conn_ttl: int
+    sync_debounce: float
+    pubsub_threads: int
+
+    @classmethod
+    def from_env(cls):
+        """Build the configuration from environment variables"""
+        return cls(
+            project_id=os.getenv('GOOGLE_CLOUD_PROJECT'),
+            subscription_name=os.getenv('PUBSUB_SUBSCRIPTION', 'gmail-sync-subscription'),
+            topic_name=os.getenv('PUBSUB_TOPIC', 'gmail-sync-topic'),
+            credentials_file=os.getenv('GOOGLE_CREDENTIALS', '/app/credentials.json'),
+            token_file=os.getenv('GOOGLE_TOKEN', '/app/token.json'),
+            user1=os.getenv('USER_1'),
+            password1=os.getenv('PASSWORD_1'),
+            host2=os.getenv('HOST_2'),
+            user2=os.getenv('USER_2'),
+            password2=os.getenv('PASSWORD_2'),
+            ssl2=os.getenv('SSL2', 'true').lower() == 'true',
+            folder=os.getenv('FOLDER', 'INBOX'),
+            move=os.getenv('MOVE', 'false').lower() == 'true',
+            reconcile_interval=int(os.getenv('RECONCILE_INTERVAL', '3600')),  # full imapsync pass
+            dest_conn_ttl=int(os.getenv('DEST_CONN_TTL', '300')),  # NOOP the destination after idling this long
+            sync_debounce=float(os.getenv('SYNC_DEBOUNCE', '0.5')),  # coalesce notification bursts
+            pubsub_threads=int(os.getenv('PUBSUB_THREADS', '32'))  # subscriber callback workers
+        )
+
 class GmailPushSync:
     def __init__(self):
         self.gmail_service = None
         self.subscriber = None
+        self.dest_conn = None
+        self.dest_conn_used_at = 0
+        self.last_history_id = None
+        self.last_reconcile = 0
+        self._fetched = []
+        self._fetch_errors = 0
+        self._retry_ids = []
+        self._delay = MIN_BACKOFF_DELAY
+        # Message IDs still to copy (with failed attempts so far), and copied ones
+        # still to archive in move mode; both survive until the next sync
+        self._pending = {}
+        self._unarchived = []
+        # History replayed over an imapsync run may already be on the destination;
+        # those messages are looked up by Message-ID before they are APPENDed
+        self._replay_overlap = False
+        self._verify = set()
         self.running = False
+        # At most one sync is ever pending; further notifications fold into it
+        self._work_q = queue.Queue(maxsize=1)
+        self._worker_thread = None
+        # Guarantees at most one sync runs at a time, whatever triggered it
         self.sync_lock = threading.Lock()
         
-        # Configuration
-        self.config = {
-            'project_id': os.getenv('GOOGLE_CLOUD_PROJECT'),
-            'subscription_name': os.getenv('PUBSUB_SUBSCRIPTION', 'gmail-sync-subscription'),
-            'topic_name': os.getenv('PUBSUB_TOPIC', 'gmail-sync-topic'),
-            'credentials_file': os.getenv('GOOGLE_CREDENTIALS', '/app/credentials.json'),
-            'token_file': os.getenv('GOOGLE_TOKEN', '/app/token.json'),
-            
-            # Destination IMAP settings
-            'host2': os.getenv('HOST_2'),
-            'user2': os.getenv('USER_2'),
-            'password2': os.getenv('PASSWORD_2'),
-            'ssl2': os.getenv('SSL2', 'true').lower() == 'true',
-            'folder': os.getenv('FOLDER', 'INBOX'),
-            'move': os.getenv('MOVE', 'false').lower() == 'true'
-        }
+        # Configuration is read from the environment once and never changes
+        self.cfg = SyncConfig.from_env()
         
-        # Gmail API scopes
-        self.scopes = ['https://www.googleapis.com/auth/gmail.readonly']
+        # Gmail API scopes (move mode needs modify access to archive copied messages)
+        if self.cfg.move:
+            self.scopes = ['https://www.googleapis.com/auth/gmail.modify']
+        else:
+            self.scopes = ['https://www.googleapis.com/auth/gmail.readonly']
     
     def authenticate_gmail(self):
         """Authenticate with Gmail API"""
         creds = None
         
         # Load existing token
-        if os.path.exists(self.config['token_file']):
-            creds = Credentials.from_authorized_user_file(self.config['token_file'], self.scopes)
+        if os.path.exists(self.cfg.token_file):
+            # A token granted read-only access cannot archive; every batchModify would fail with 403.
+            # Copy mode needs no check: gmail.modify already covers gmail.readonly
+            if self.cfg.move:
+                with open(self.cfg.token_file) as f:
+                    granted = json.load(f).get('scopes')
+                missing = [scope for scope in self.scopes if granted and scope not in granted]
+                if missing:
+                    raise RuntimeError(f"{self.cfg.token_file} lacks the required scopes {missing}; "
+                                       f"delete it and re-authorize (MOVE mode needs gmail.modify)")
+            creds = Credentials.from_authorized_user_file(self.cfg.token_file, self.scopes)
         
         # If no valid credentials, get new ones
         if not creds or not creds.valid:
@@ -68,14 +165,17 @@ class GmailPushSync:
                 creds.refresh(Request())
             else:
                 flow = InstalledAppFlow.from_client_secrets_file(
-                    self.config['credentials_file'], self.scopes)
+                    self.cfg.credentials_file, self.scopes)
                 creds = flow.run_local_server(port=0)
             
             # Save credentials for next run
-            with open(self.config['token_file'], 'w') as token:
+            with open(self.cfg.token_file, 'w') as token:
                 token.write(creds.to_json())
         
-        self.gmail_service = build('gmail', 'v1', credentials=creds)
+        # One authorized keep-alive connection shared by every API call, instead of
+        # a new TLS handshake per request. Only the sync worker uses it after startup.
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=30))
+        self.gmail_service = build('gmail', 'v1', http=http, cache_discovery=False)
         logger.info("Gmail API authenticated successfully")
     
     def setup_push_notifications(self):
@@ -83,7 +183,7 @@ class GmailPushSync:
         try:
             # Create watch request
             request = {
-                'topicName': f'projects/{self.config["project_id"]}/topics/{self.config["topic_name"]}',
+                'topicName': f'projects/{self.cfg.project_id}/topics/{self.cfg.topic_name}',
                 'labelIds': ['INBOX']
             }
             
@@ -92,8 +192,8 @@ class GmailPushSync:
             
             # Set up Pub/Sub subscriber
             subscriber_path = self.subscriber.subscription_path(
-                self.config['project_id'], 
-                self.config['subscription_name']
+                self.cfg.project_id, 
+                self.cfg.subscription_name
             )
             
             logger.info(f"Listening for messages on {subscriber_path}")
@@ -103,83 +203,386 @@ class GmailPushSync:
             logger.error(f"Failed to set up push notifications: {e}")
             return False
     
-    def sync_emails_gmail_api(self):
-        """Sync emails using Gmail API + imapsync for destination"""
-        with self.sync_lock:
-            logger.info("Starting Gmail API synchronization...")
-            
+    def connect_destination(self):
+        """Establish connection to destination IMAP server"""
+        try:
+            if self.cfg.ssl2:
+                self.dest_conn = imaplib.IMAP4_SSL(self.cfg.host2)
+            else:
+                self.dest_conn = imaplib.IMAP4(self.cfg.host2)
+
+            self.dest_conn.login(self.cfg.user2, self.cfg.password2)
+            self.dest_conn.select(self.cfg.folder)
+            logger.info(f"Connected to destination: {self.cfg.host2}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to connect to destination: {e}")
+            self.dest_conn = None
+            return False
+
+    def _ensure_dest(self):
+        """Reuse the persistent destination connection, reconnecting lazily after an abort"""
+        # Between notifications the connection can outlast the server's autologout
+        if self.dest_conn is not None and time.time() - self.dest_conn_used_at >= self.cfg.dest_conn_ttl:
             try:
-                # Get recent messages from Gmail API
-                results = self.gmail_service.users().messages().list(
-                    userId='me', 
-                    labelIds=['INBOX'],
-                    maxResults=50  # Adjust as needed
-                ).execute()
-                
-                messages = results.get('messages', [])
-                logger.info(f"Found {len(messages)} messages to process")
-                
-                # For each message, we could process individually
-                # But for simplicity, let's trigger a full imapsync
-                return self.sync_with_imapsync()
-                
-            except Exception as e:
-                logger.error(f"Gmail API sync error: {e}")
+                self.dest_conn.noop()
+            except (imaplib.IMAP4.error, OSError) as e:
+                logger.info(f"Reconnecting idle destination connection: {e}")
+                self.dest_conn = None
+        if self.dest_conn is None and not self.connect_destination():
+            return False
+        self.dest_conn_used_at = time.time()
+        return True
+
+    def _backoff(self, reason):
+        """Sleep for the shared delay, then double it for the next retry"""
+        logger.warning(f"{reason}, retrying in {self._delay:.0f}s")
+        time.sleep(self._delay)
+        self._delay = min(self._delay * 2, MAX_BACKOFF_DELAY)
+
+    def _with_backoff(self, callable_):
+        """Call a Gmail API request, backing off on 429/5xx and recovering after one success"""
+        for attempt in range(MAX_BACKOFF_ATTEMPTS + 1):
+            try:
+                result = callable_()
+            except HttpError as e:
+                if e.resp.status not in RETRYABLE_STATUSES or attempt == MAX_BACKOFF_ATTEMPTS:
+                    raise
+                self._backoff(f"Gmail API returned {e.resp.status}")
+                continue
+
+            self._delay = max(MIN_BACKOFF_DELAY, self._delay / 2)
+            return result
+
+    def fetch_history_changes(self):
+        """Collect INBOX message IDs added/deleted since the last known historyId"""
+        added_ids = []
+        deleted_ids = set()
+        request = self.gmail_service.users().history().list(
+            userId='me',
+            startHistoryId=self.last_history_id,
+            labelId='INBOX',
+            historyTypes=['messageAdded', 'messageDeleted']
+        )
+
+        history_id = self.last_history_id
+        while request is not None:
+            results = self._with_backoff(request.execute)
+            for record in results.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    added_ids.append(added['message']['id'])
+                for deleted in record.get('messagesDeleted', []):
+                    deleted_ids.add(deleted['message']['id'])
+            history_id = results.get('historyId', history_id)
+            request = self.gmail_service.users().history().list_next(request, results)
+
+        # Messages added and deleted again within the window need no transfer
+        added_ids = [mid for mid in dict.fromkeys(added_ids) if mid not in deleted_ids]
+        return added_ids, deleted_ids, history_id
+
+    def _on_message_fetched(self, request_id, response, exception):
+        """Batch callback: decode a fetched raw message for the APPEND pass"""
+        if exception is not None:
+            if isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES:
+                self._retry_ids.append(request_id)
+                return
+            logger.error(f"Failed to fetch message {request_id}: {exception}")
+            self._fetch_errors += 1
+            return
+
+        # urlsafe_b64decode accepts the str directly and yields the RFC822 bytes
+        # that APPEND needs, without an intermediate ASCII copy
+        raw = base64.urlsafe_b64decode(response['raw'])
+        flags = None if 'UNREAD' in response.get('labelIds', []) else '(\\Seen)'
+        internaldate = imaplib.Time2Internaldate(int(response['internalDate']) / 1000)
+        self._fetched.append((response['id'], flags, internaldate, raw))
+
+    def fetch_raw_messages(self, message_ids):
+        """Fetch up to GMAIL_BATCH_SIZE raw messages in a single batch HTTP request"""
+        self._fetched = []
+        self._fetch_errors = 0
+
+        pending = message_ids
+        for attempt in range(MAX_BACKOFF_ATTEMPTS + 1):
+            self._retry_ids = []
+            batch = self.gmail_service.new_batch_http_request(callback=self._on_message_fetched)
+            for mid in pending:
+                batch.add(
+                    self.gmail_service.users().messages().get(userId='me', id=mid, format='raw'),
+                    request_id=mid
+                )
+            self._with_backoff(batch.execute)
+
+            # Rate-limited parts of the batch are retried on their own
+            pending = self._retry_ids
+            if not pending:
+                break
+            if attempt == MAX_BACKOFF_ATTEMPTS:
+                logger.error(f"Giving up on {len(pending)} rate limited message fetches")
+                self._fetch_errors += len(pending)
+                break
+            self._backoff(f"{len(pending)} message fetches were rate limited")
+
+        fetched, self._fetched = self._fetched, []
+        return fetched, self._fetch_errors
+
+    def _exists_on_destination(self, raw):
+        """Whether a message with the same Message-ID is already in the destination folder"""
+        message_id = BytesHeaderParser().parsebytes(raw).get('Message-ID', '').strip()
+        # Without a usable Message-ID there is nothing to match on; copy it
+        if not message_id or '"' in message_id or '\\' in message_id:
+            return False
+        result, data = self.dest_conn.uid('SEARCH', 'HEADER', 'Message-ID', f'"{message_id}"')
+        return result == 'OK' and bool(data[0].split())
+
+    def append_to_destination(self, flags, internaldate, raw, check_existing=False):
+        """APPEND a raw message to the destination folder; returns False if it was already there"""
+        if not self._ensure_dest():
+            raise imaplib.IMAP4.error("Destination connection unavailable")
+
+        try:
+            if check_existing and self._exists_on_destination(raw):
                 return False
-    
+            result, data = self.dest_conn.append(self.cfg.folder, flags, internaldate, raw)
+        except (imaplib.IMAP4.abort, OSError):
+            # Drop the broken connection (protocol abort or socket error) so the next APPEND reconnects
+            self.dest_conn = None
+            raise
+        if result != 'OK':
+            raise imaplib.IMAP4.error(f"APPEND failed: {data}")
+        return True
+
+    def sync_emails_gmail_api(self):
+        """Sync emails added since the last notification using the Gmail history API"""
+        if not self.last_history_id:
+            return self.full_sync()
+
+        logger.info(f"Starting Gmail API synchronization from history {self.last_history_id}...")
+
+        try:
+            added_ids, deleted_ids, history_id = self.fetch_history_changes()
+        except HttpError as e:
+            if e.resp.status == 404:
+                # Gmail only keeps history for a limited time; start over with a full sync
+                logger.warning("Gmail history expired, performing full synchronization")
+                self.last_history_id = None
+                return self.full_sync()
+            logger.error(f"Gmail API sync error: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Gmail API sync error: {e}")
+            return False
+
+        logger.info(f"Found {len(added_ids)} new messages to process")
+        if deleted_ids:
+            # One-way sync: removals on the source are never propagated (as with imapsync)
+            logger.info(f"Ignoring {len(deleted_ids)} messages deleted from Gmail")
+
+        # The cursor always moves forward; messages that fail are tracked and retried
+        # on their own, so a replayed window can never APPEND a message twice
+        self.last_history_id = history_id
+        for mid in added_ids:
+            self._pending.setdefault(mid, 0)
+        for mid in deleted_ids:
+            self._pending.pop(mid, None)
+        if self._replay_overlap:
+            self._verify.update(added_ids)
+            self._replay_overlap = False
+
+        if not self._pending and not self._unarchived:
+            return self.reconcile_if_due()
+
+        if not self._ensure_dest():
+            return False
+
+        transferred = 0
+        errors = 0
+        pending_ids = list(self._pending)
+
+        try:
+            for i in range(0, len(pending_ids), GMAIL_BATCH_SIZE):
+                batch_ids = pending_ids[i:i + GMAIL_BATCH_SIZE]
+                fetched, _ = self.fetch_raw_messages(batch_ids)
+
+                # Second pass: push the whole batch to the destination
+                appended = []
+                for mid, flags, internaldate, raw in fetched:
+                    try:
+                        if self.append_to_destination(flags, internaldate, raw, mid in self._verify):
+                            transferred += 1
+                        else:
+                            logger.info(f"Message {mid} was already copied by imapsync")
+                        appended.append(mid)
+                        del self._pending[mid]
+                    except Exception as e:
+                        logger.error(f"Failed to append message {mid}: {e}")
+
+                # Whatever is still pending failed to fetch or APPEND
+                for mid in batch_ids:
+                    if mid in self._pending:
+                        errors += 1
+                        self._pending[mid] += 1
+                        if self._pending[mid] >= MAX_MESSAGE_ATTEMPTS:
+                            del self._pending[mid]
+                            logger.warning(f"Giving up on message {mid}, leaving it to the next imapsync reconcile")
+
+                if self.cfg.move:
+                    self._unarchived.extend(appended)
+                    if not self.archive_transferred():
+                        errors += 1
+        except Exception as e:
+            logger.error(f"Gmail API sync error: {e}")
+            return False
+        finally:
+            self._verify.intersection_update(self._pending)
+
+        if errors:
+            logger.error(f"Transferred {transferred} messages, {errors} failed")
+            return False
+
+        logger.info(f"Synchronization completed successfully: {transferred} messages transferred")
+        return self.reconcile_if_due()
+
+    def archive_transferred(self):
+        """Remove the INBOX label from copied messages; failures are retried on the next sync"""
+        try:
+            while self._unarchived:
+                # Removing the INBOX label matches Gmail's IMAP expunge (archive) behaviour
+                ids = self._unarchived[:GMAIL_MODIFY_BATCH_SIZE]
+                self._with_backoff(self.gmail_service.users().messages().batchModify(
+                    userId='me',
+                    body={'ids': ids, 'removeLabelIds': ['INBOX']}
+                ).execute)
+                del self._unarchived[:len(ids)]
+            return True
+        except Exception as e:
+            logger.error(f"Failed to archive {len(self._unarchived)} copied messages: {e}")
+            return False
+
+    def full_sync(self):
+        """Full imapsync pass, then replay the history that arrived while it ran"""
+        # Taken before imapsync, so mail reaching INBOX during the run is still in history
+        profile = self._with_backoff(self.gmail_service.users().getProfile(userId='me').execute)
+        if not self.sync_with_imapsync():
+            return False
+        self.last_history_id = profile['historyId']
+        self._replay_overlap = True
+        return self.sync_emails_gmail_api()
+
+    def reconcile_if_due(self):
+        """Run the full imapsync pass when the reconcile interval has elapsed"""
+        if time.time() - self.last_reconcile < self.cfg.reconcile_interval:
+            return True
+        return self.sync_with_imapsync()
+
     def sync_with_imapsync(self):
-        """Fallback to imapsync for actual synchronization"""
+        """Full reconcile with imapsync (startup, expired history and hourly)"""
+        self.last_reconcile = time.time()
         logger.info("Performing imapsync synchronization...")
         
         # Build imapsync command (Gmail source)
         cmd = [
             'imapsync',
             '--host1', 'imap.gmail.com',
-            '--user1', os.getenv('USER_1'),
-            '--password1', os.getenv('PASSWORD_1'),
+            '--user1', self.cfg.user1,
+            '--password1', self.cfg.password1,
             '--ssl1',
-            '--host2', self.config['host2'],
-            '--user2', self.config['user2'],
-            '--password2', self.config['password2'],
-            '--folder', self.config['folder'],
-            '--useuid', '--automap', '--fastio1', '--fastio2',
+            '--host2', self.cfg.host2,
+            '--user2', self.cfg.user2,
+            '--password2', self.cfg.password2,
+            '--folder', self.cfg.folder,
+            # No --useuid: messages APPENDed by the history sync are not in imapsync's
+            # UID cache, so they must be recognised by their headers instead
+            '--automap', '--fastio1', '--fastio2',
             '--syncinternaldates', '--skipcrossduplicates'
         ]
         
-        if self.config['ssl2']:
+        if self.cfg.ssl2:
             cmd.append('--ssl2')
         
-        if self.config['move']:
+        if self.cfg.move:
             cmd.append('--delete1')
         
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            if result.returncode == 0:
+            # Stream the output line by line instead of buffering all of it in memory
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    bufsize=1, text=True)
+            watchdog = threading.Timer(300, proc.kill)
+            watchdog.start()
+
+            tail = collections.deque(maxlen=20)
+            try:
+                for line in proc.stdout:
+                    logger.debug(line.rstrip())
+                    tail.append(line)
+                returncode = proc.wait()
+            finally:
+                watchdog.cancel()
+
+            if returncode == -signal.SIGKILL:
+                logger.error("Synchronization timed out")
+                return False
+            if returncode == 0:
                 logger.info("Synchronization completed successfully")
+                # imapsync has copied anything still waiting for a retry
+                self._pending.clear()
+                self._verify.clear()
                 return True
             else:
-                logger.error(f"Synchronization failed: {result.stderr}")
+                logger.error(f"Synchronization failed: {''.join(tail)}")
                 return False
         except Exception as e:
             logger.error(f"Synchronization error: {e}")
             return False
     
+    def _sync_worker(self):
+        """Run queued syncs one at a time, outside the subscriber callback threads"""
+        while self.running:
+            if self._work_q.get() is None:
+                break
+
+            # Let the rest of a burst arrive, then fold it into this sync
+            time.sleep(self.cfg.sync_debounce)
+            try:
+                self._work_q.get_nowait()
+            except queue.Empty:
+                pass
+
+            # Wait rather than drop: notifications arriving meanwhile fold into the queue
+            with self.sync_lock:
+                try:
+                    self.sync_emails_gmail_api()
+                except Exception as e:
+                    # This is the only worker; it must survive to handle the next notification
+                    logger.error(f"Sync failed: {e}")
+
     def callback(self, message):
         """Handle Pub/Sub messages (Gmail notifications)"""
+        # Ack first so flow-control credit is released immediately; the sync
+        # itself runs on the worker and a redelivery would not help it
+        message.ack()
+
         try:
-            # Decode the message
-            data = json.loads(message.data.decode('utf-8'))
-            logger.info(f"Received Gmail notification: {data}")
-            
-            # Trigger synchronization
-            self.sync_emails_gmail_api()
-            
-            # Acknowledge the message
-            message.ack()
-            
+            match = HISTORY_ID_RE.search(message.data)
+            if not match:
+                logger.warning(f"Ignoring notification without historyId: {message.data[:200]!r}")
+                return
+            history_id = int(match.group(1))
+            logger.info(f"Received Gmail notification: historyId={history_id}")
+
+            # Redeliveries and out-of-order notifications are already covered
+            if self.last_history_id and history_id <= int(self.last_history_id):
+                logger.info(f"Notification {history_id} already synced, skipping")
+                return
+
+            # Hand off to the sync worker; a full queue already has a sync pending
+            try:
+                self._work_q.put_nowait(history_id)
+            except queue.Full:
+                pass
+
         except Exception as e:
             logger.error(f"Error processing notification: {e}")
-            message.nack()
     
     def start(self):
         """Start the Gmail push notification service"""
@@ -196,24 +599,39 @@ class GmailPushSync:
             if not self.setup_push_notifications():
                 raise Exception("Failed to set up push notifications")
             
-            # Initial sync
-            self.sync_emails_gmail_api()
+            # Initial full sync; notifications are handled incrementally afterwards.
+            # On failure the cursor stays unset, so the next notification retries it
+            with self.sync_lock:
+                try:
+                    self.full_sync()
+                except Exception as e:
+                    logger.error(f"Initial synchronization failed: {e}")
             
             # Start listening for notifications
             self.running = True
+            self._worker_thread = threading.Thread(target=self._sync_worker, daemon=True)
+            self._worker_thread.start()
             subscription_path = self.subscriber.subscription_path(
-                self.config['project_id'], 
-                self.config['subscription_name']
+                self.cfg.project_id, 
+                self.cfg.subscription_name
             )
             
-            # Configure flow control
-            flow_control = pubsub_v1.types.FlowControl(max_messages=100)
-            
+            # Configure flow control and an explicitly sized callback executor
+            flow_control = pubsub_v1.types.FlowControl(
+                max_messages=1000,
+                max_bytes=100 * 1024 * 1024,
+                max_lease_duration=600
+            )
+            scheduler = ThreadScheduler(
+                executor=ThreadPoolExecutor(max_workers=self.cfg.pubsub_threads)
+            )
+
             logger.info("Listening for Gmail push notifications...")
             streaming_pull_future = self.subscriber.subscribe(
                 subscription_path, 
                 callback=self.callback,
-                flow_control=flow_control
+                flow_control=flow_control,
+                scheduler=scheduler
             )
             
             # Keep the main thread running
@@ -231,6 +649,18 @@ class GmailPushSync:
         logger.info("Stopping Gmail Push Notification service...")
         self.running = False
 
+        # Wake the sync worker so it can exit
+        try:
+            self._work_q.put_nowait(None)
+        except queue.Full:
+            pass
+
+        if self.dest_conn:
+            try:
+                self.dest_conn.logout()
+            except:
+                pass
+
 if __name__ == "__main__":
     try:
         sync_service = GmailPushSync()
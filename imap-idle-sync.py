@@ -14,7 +14,15 @@ import threading
 from email.mime.text import MIMEText
 import subprocess
 import json
-from datetime import datetime
+import queue
+import re
+import collections
+import contextlib
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from imapclient import IMAPClient
+from imapclient.exceptions import ProtocolError
 
 # Configure logging
 logging.basicConfig(
@@ -27,338 +35,822 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Messages per UID FETCH in the direct-transfer path, and how many fetched
+# batches may wait for APPEND before the fetcher blocks
+FETCH_BATCH_SIZE = 50
+FETCH_QUEUE_DEPTH = 4
+
+# Parallel destination connections used for APPEND (kept low for per-IP connection limits)
+APPEND_WORKERS = 4
+
+# Attempts per message before a failed APPEND is left to the periodic imapsync reconcile
+MAX_APPEND_ATTEMPTS = 3
+
+# imapsync run limit, and how many trailing output lines are kept for error reports
+IMAPSYNC_TIMEOUT = 600  # 10 minutes
+IMAPSYNC_TAIL_LINES = 200
+
+# Health file read by health-check.sh, and how often an unchanged status is rewritten
+HEALTH_FILE = "/app/data/health"
+HEALTH_WRITE_INTERVAL = 30
+
+# Message count in an untagged STATUS response
+MESSAGES_RE = re.compile(rb'MESSAGES (\d+)')
+
+# Summary lines imapsync might print, matched against every output line
+_STAT_PATTERNS = tuple((re.compile(pattern, re.IGNORECASE), stat_type) for pattern, stat_type in (
+    (r'Transferred:\s*(\d+)', 'transferred'),
+    (r'Skipped:\s*(\d+)', 'skipped'),
+    (r'Errors:\s*(\d+)', 'errors'),
+    (r'(\d+)\s+messages\s+transferred', 'transferred'),
+    (r'(\d+)\s+messages\s+skipped', 'skipped'),
+    (r'(\d+)\s+messages\s+copied', 'transferred'),
+    (r'Total\s+bytes\s+transferred:\s*(\d+)', 'bytes'),
+))
+
+# imaplib only issues commands it knows the valid states for
+imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+
+def enable_compression(imap):
+    """Negotiate RFC 4978 COMPRESS=DEFLATE on an authenticated imaplib connection.
+
+    imaplib has no support for it, so the instance's send/read/readline are
+    replaced with versions that deflate and inflate the stream. Returns True
+    if compression is active.
+    """
+    # Servers often only advertise COMPRESS once authenticated
+    typ, data = imap.capability()
+    if typ != 'OK' or b'COMPRESS=DEFLATE' not in data[-1].upper().split():
+        return False
+    typ, data = imap._simple_command('COMPRESS', 'DEFLATE')
+    if typ != 'OK':
+        return False
+
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    decompressor = zlib.decompressobj(-15)
+    inflated = bytearray()
+    raw_send = imap.send
+
+    def fill():
+        # On a non-blocking socket (IMAPClient.idle_check) recv raises when nothing
+        # is pending; a partially received line simply stays in the buffer
+        chunk = imap.sock.recv(65536)
+        if not chunk:
+            raise imap.abort('socket error: EOF')
+        inflated.extend(decompressor.decompress(chunk))
+
+    def send(data):
+        raw_send(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def read(size):
+        while len(inflated) < size:
+            fill()
+        data = bytes(inflated[:size])
+        del inflated[:size]
+        return data
+
+    def readline():
+        end = inflated.find(b'\n')
+        while end < 0:
+            fill()
+            end = inflated.find(b'\n')
+        line = bytes(inflated[:end + 1])
+        del inflated[:end + 1]
+        return line
+
+    imap.send = send
+    imap.read = read
+    imap.readline = readline
+    return True
+
+# Environment variables read by SyncConfig.from_env, and the settings that must be set
+_CONFIG_KEYS = frozenset({
+    'HOST_1', 'USER_1', 'PASSWORD_1', 'HOST_2', 'USER_2', 'PASSWORD_2',
+    'FOLDER', 'SSL1', 'SSL2', 'MOVE', 'IDLE_TIMEOUT', 'DATE_FILTER_DAYS',
+    'MAX_EMAILS_PER_SYNC', 'MAX_EMAIL_SIZE', 'RECONCILE_INTERVAL', 'STATE_DIR',
+    'DEST_CONN_TTL', 'COMPRESS',
+})
+_REQUIRED_CONFIG = ('host1', 'user1', 'password1', 'host2', 'user2', 'password2')
+
+@dataclass(frozen=True, slots=True)
+class SyncConfig:
+    """Service configuration, resolved from the environment at startup"""
+    host1: str
+    user1: str
+    password1: str
+    host2: str
+    user2: str
+    password2: str
+    folder: str
+    ssl1: bool
+    ssl2: bool
+    move: bool
+    idle_timeout: int
+    date_filter_days: int
+    max_emails_per_sync: int
+    max_email_size: int
+    reconcile_interval: int
+    state_dir: str
+    dest_conn_ttl: int
+    compress: bool
+
+    @classmethod
+    def from_env(cls):
+        """Build the configuration from environment variables with safety defaults"""
+        # One pass over the environment instead of a lookup per setting
+        env = {k: v for k, v in os.environ.items() if k in _CONFIG_KEYS}
+        return cls(
+            host1=env.get('HOST_1'),
+            user1=env.get('USER_1'),
+            password1=env.get('PASSWORD_1'),
+            host2=env.get('HOST_2'),
+            user2=env.get('USER_2'),
+            password2=env.get('PASSWORD_2'),
+            folder=env.get('FOLDER', 'INBOX'),
+            ssl1=env.get('SSL1', 'true').lower() == 'true',
+            ssl2=env.get('SSL2', 'true').lower() == 'true',
+            move=env.get('MOVE', 'false').lower() == 'true',
+            idle_timeout=int(env.get('IDLE_TIMEOUT', '1740')),  # 29 minutes (Gmail limit is 30)
+            date_filter_days=int(env.get('DATE_FILTER_DAYS', '30')),
+            max_emails_per_sync=int(env.get('MAX_EMAILS_PER_SYNC', '1000')),
+            max_email_size=int(env.get('MAX_EMAIL_SIZE', '50000000')),  # 50MB
+            reconcile_interval=int(env.get('RECONCILE_INTERVAL', '3600')),  # full imapsync pass
+            state_dir=env.get('STATE_DIR', '/app/data/state'),  # sync checkpoints
+            dest_conn_ttl=int(env.get('DEST_CONN_TTL', '300')),  # NOOP pooled connections idle this long
+            compress=env.get('COMPRESS', 'true').lower() == 'true'  # COMPRESS=DEFLATE when offered
+        )
+
 class IMAPIdleSync:
     def __init__(self):
         self.source_conn = None
+        self.idle_conn = None
+        self.last_uid = None
+        self.uidvalidity = None
+        # UIDs at or below last_uid whose APPEND failed, with failed attempts so far;
+        # retried by UID on the next sync instead of waiting for the reconcile
+        self._retry_uids = {}
+        self.last_reconcile = 0
         self.running = False
         self.idle_thread = None
+        self.sync_thread = None
         self.sync_lock = threading.Lock()
+        # Set by the IDLE thread, consumed by the sync worker; repeated wakeups coalesce
+        self._dirty = threading.Event()
+        self._stop_event = threading.Event()
+        # Both the IDLE and sync threads report health through one temp file
+        self._health_lock = threading.Lock()
+        self._last_health = (None, 0)
+        self._imapsync_proc = None
+
+        # Destination connections for parallel APPEND as (connection, last used)
+        # pairs, opened lazily (None = not connected)
+        self._dest_pool = queue.Queue()
+        for _ in range(APPEND_WORKERS):
+            self._dest_pool.put((None, 0))
         
-        # Configuration from environment with safety defaults
-        self.config = {
-            'host1': os.getenv('HOST_1'),
-            'user1': os.getenv('USER_1'),
-            'password1': os.getenv('PASSWORD_1'),
-            'host2': os.getenv('HOST_2'),
-            'user2': os.getenv('USER_2'),
-            'password2': os.getenv('PASSWORD_2'),
-            'folder': os.getenv('FOLDER', 'INBOX'),
-            'ssl1': os.getenv('SSL1', 'true').lower() == 'true',
-            'ssl2': os.getenv('SSL2', 'true').lower() == 'true',
-            'move': os.getenv('MOVE', 'false').lower() == 'true',
-            'idle_timeout': int(os.getenv('IDLE_TIMEOUT', '1740')),  # 29 minutes (Gmail limit is 30)
-            'date_filter_days': int(os.getenv('DATE_FILTER_DAYS', '30')),
-            'max_emails_per_sync': int(os.getenv('MAX_EMAILS_PER_SYNC', '1000')),
-            'max_email_size': int(os.getenv('MAX_EMAIL_SIZE', '50000000'))  # 50MB
-        }
+        # Configuration is read from the environment once and never changes
+        self.cfg = SyncConfig.from_env()
         
         # Validate configuration
-        required = ['host1', 'user1', 'password1', 'host2', 'user2', 'password2']
-        missing = [k for k in required if not self.config[k]]
+        missing = [k for k in _REQUIRED_CONFIG if not getattr(self.cfg, k)]
         if missing:
             raise ValueError(f"Missing required config: {missing}")
+
+        self.checkpoint_file = os.path.join(self.cfg.state_dir, f"{self.cfg.user1}.json")
+
+        # Fixed part of the imapsync command line
+        self._base_imapsync_cmd = [
+            'imapsync',
+            '--host1', self.cfg.host1,
+            '--user1', self.cfg.user1,
+            '--password1', self.cfg.password1,
+            '--host2', self.cfg.host2,
+            '--user2', self.cfg.user2,
+            '--password2', self.cfg.password2,
+            '--folder', self.cfg.folder,
+            # No --useuid: messages APPENDed by the fast path are not in imapsync's
+            # UID cache, so they must be recognised by their headers instead
+            '--automap', '--fastio1', '--fastio2',
+            '--syncinternaldates', '--skipcrossduplicates',
+            '--maxsize', str(self.cfg.max_email_size)
+            # Note: --sleep option removed as it's not supported in this version of imapsync
+        ]
+        if self.cfg.ssl1:
+            self._base_imapsync_cmd.append('--ssl1')
+        if self.cfg.ssl2:
+            self._base_imapsync_cmd.append('--ssl2')
+        # Move mode deletes from the source after copying
+        if self.cfg.move:
+            self._base_imapsync_cmd.append('--delete1')
     
+    def _open_source_conn(self):
+        """Open, authenticate and SELECT a new source connection; returns (client, SELECT response)"""
+        client = IMAPClient(self.cfg.host1, ssl=self.cfg.ssl1)
+        # Keep INTERNALDATE timezone-aware so it can be passed straight to APPEND
+        client.normalise_times = False
+
+        client.login(self.cfg.user1, self.cfg.password1)
+        if self.cfg.compress and enable_compression(client._imap):
+            logger.info("Source connection compressed (COMPRESS=DEFLATE)")
+        folder_info = client.select_folder(self.cfg.folder)
+        logger.info(f"Connected to source: {self.cfg.host1}")
+        return client, folder_info
+
+    def connect_idle(self):
+        """Establish the source connection that only listens in IDLE"""
+        try:
+            self.idle_conn, _ = self._open_source_conn()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to connect to source for IDLE: {e}")
+            return False
+
     def connect_source(self):
-        """Establish connection to source IMAP server"""
+        """Establish the source connection used for syncing"""
         try:
-            if self.config['ssl1']:
-                self.source_conn = imaplib.IMAP4_SSL(self.config['host1'])
-            else:
-                self.source_conn = imaplib.IMAP4(self.config['host1'])
-            
-            self.source_conn.login(self.config['user1'], self.config['password1'])
-            self.source_conn.select(self.config['folder'])
-            logger.info(f"Connected to source: {self.config['host1']}")
+            self.source_conn, folder_info = self._open_source_conn()
+
+            # UIDs are only comparable while UIDVALIDITY stays the same
+            uidvalidity = folder_info[b'UIDVALIDITY']
+            if uidvalidity != self.uidvalidity:
+                self.uidvalidity = uidvalidity
+                self.last_uid = None
+                self._retry_uids = {}
+
+                checkpoint = self.load_checkpoint()
+                if checkpoint and checkpoint['uidvalidity'] == uidvalidity:
+                    self.last_uid = checkpoint['uidnext'] - 1
+                    self._retry_uids = dict.fromkeys(checkpoint.get('retry', []), 0)
+                    logger.info(f"Resuming from checkpoint: next UID {checkpoint['uidnext']}")
+                else:
+                    logger.info("No valid sync checkpoint, a full synchronization is needed")
             return True
         except Exception as e:
             logger.error(f"Failed to connect to source: {e}")
             return False
-    
-    def update_health_file(self, status="healthy"):
-        """Update health status file for Docker health checks"""
+
+    def _open_dest_conn(self):
+        """Open, authenticate and SELECT a new destination connection"""
+        if self.cfg.ssl2:
+            conn = imaplib.IMAP4_SSL(self.cfg.host2)
+        else:
+            conn = imaplib.IMAP4(self.cfg.host2)
+
+        conn.login(self.cfg.user2, self.cfg.password2)
+        if self.cfg.compress:
+            enable_compression(conn)
+        conn.select(self.cfg.folder)
+        logger.info(f"Connected to destination: {self.cfg.host2}")
+        return conn
+
+    @contextlib.contextmanager
+    def _borrow_dest(self):
+        """Borrow a pooled destination connection, reconnecting it if it has gone stale"""
+        conn, last_used = self._dest_pool.get()
+        try:
+            # A quiet spell can outlast the server's autologout, so check before reuse
+            if conn is not None and time.time() - last_used >= self.cfg.dest_conn_ttl:
+                try:
+                    conn.noop()
+                except (imaplib.IMAP4.error, OSError) as e:
+                    logger.info(f"Reconnecting idle destination connection: {e}")
+                    conn = None
+            if conn is None:
+                conn = self._open_dest_conn()
+            yield conn
+        except (imaplib.IMAP4.abort, OSError) as e:
+            # Socket errors surface as OSError, not abort; either way drop the
+            # broken connection so its slot reconnects on next use
+            logger.warning(f"Destination connection lost: {e}")
+            conn = None
+            raise
+        finally:
+            self._dest_pool.put((conn, time.time()))
+
+    def _check_dest(self):
+        """Make sure at least one pooled destination connection is usable"""
         try:
-            health_file = "/app/data/health"
-            with open(health_file, 'w') as f:
-                f.write(f"{status}\n")
-                f.write(f"{int(time.time())}\n")
+            with self._borrow_dest():
+                return True
         except Exception as e:
-            logger.warning(f"Failed to update health file: {e}")
+            logger.error(f"Failed to connect to destination: {e}")
+            return False
 
-    def check_existing_emails(self):
-        """Check for existing emails in both source and destination folders and log statistics"""
+    def _append_message(self, message):
+        """APPEND one message over a pooled destination connection"""
+        uid, flags, internaldate, raw = message
+        with self._borrow_dest() as conn:
+            result, response = conn.append(self.cfg.folder, flags, internaldate, raw)
+            if result != 'OK':
+                raise imaplib.IMAP4.error(f"APPEND of UID {uid} failed: {response}")
+        return uid
+
+    def update_last_uid(self, uidnext):
+        """Record everything below the given UIDNEXT as synchronized"""
+        self.last_uid = uidnext - 1
+        logger.info(f"Highest source UID: {self.last_uid}")
+        self.save_checkpoint()
+
+    def load_checkpoint(self):
+        """Load the UIDVALIDITY/UIDNEXT pair saved after the last successful sync"""
         try:
-            import datetime
-            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=self.config['date_filter_days'])
-            date_str = cutoff_date.strftime("%d-%b-%Y")
+            with open(self.checkpoint_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to load sync checkpoint: {e}")
+            return None
 
-            source_count = 0
-            dest_count = 0
+    def save_checkpoint(self):
+        """Persist UIDVALIDITY and the next UID to fetch, replacing the file atomically"""
+        try:
+            os.makedirs(self.cfg.state_dir, exist_ok=True)
+            tmp_file = f"{self.checkpoint_file}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump({'uidvalidity': self.uidvalidity, 'uidnext': self.last_uid + 1,
+                           'retry': sorted(self._retry_uids)}, f)
+            os.replace(tmp_file, self.checkpoint_file)
+        except Exception as e:
+            logger.warning(f"Failed to save sync checkpoint: {e}")
+    
+    def update_health_file(self, status="healthy"):
+        """Update health status file for Docker health checks"""
+        with self._health_lock:
+            now = int(time.time())
+            last_status, last_write = self._last_health
+            # Unchanged status only needs refreshing well within the health check's staleness limit
+            if status == last_status and now - last_write < HEALTH_WRITE_INTERVAL:
+                return
 
-            # Check source folder
-            if self.source_conn:
+            try:
+                # Write a sibling temp file and rename it so the check never reads a partial file
+                tmp_file = f"{HEALTH_FILE}.tmp"
+                fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
                 try:
-                    result, message_ids = self.source_conn.search(None, f'SINCE {date_str}')
-                    if result == 'OK':
-                        ids = message_ids[0].split() if message_ids[0] else []
-                        source_count = len(ids)
-                        logger.info(f"📧 SOURCE: Found {source_count} emails in {self.config['user1']}@{self.config['host1']}:{self.config['folder']} from last {self.config['date_filter_days']} days")
-                    else:
-                        logger.warning(f"Failed to search source emails: {result}")
-                except Exception as e:
-                    logger.error(f"Failed to check source emails: {e}")
+                    os.write(fd, f"{status}\n{now}\n".encode())
+                finally:
+                    os.close(fd)
+                os.replace(tmp_file, HEALTH_FILE)
+                self._last_health = (status, now)
+            except Exception as e:
+                logger.warning(f"Failed to update health file: {e}")
 
-            # Check destination folder
-            dest_conn = None
-            try:
-                # Connect to destination
-                if self.config['ssl2']:
-                    dest_conn = imaplib.IMAP4_SSL(self.config['host2'])
-                else:
-                    dest_conn = imaplib.IMAP4(self.config['host2'])
+    def _count_source(self):
+        """Count the messages in the source folder with a single STATUS"""
+        try:
+            count = self.source_conn.folder_status(self.cfg.folder, ['MESSAGES'])[b'MESSAGES']
+            logger.info("📧 SOURCE: Found %d emails in %s@%s:%s", count, self.cfg.user1, self.cfg.host1, self.cfg.folder)
+            return count
+        except Exception as e:
+            logger.error("Failed to check source emails: %s", e)
+            return 0
 
-                dest_conn.login(self.config['user2'], self.config['password2'])
-                dest_conn.select(self.config['folder'])
+    def _count_new_source(self):
+        """Count source messages above the checkpointed UID, or None if the search fails"""
+        try:
+            # "n:*" always matches the highest message, even when n is above it
+            ids = [uid for uid in self.source_conn.search(['UID', f'{self.last_uid + 1}:*'])
+                   if uid > self.last_uid]
+            logger.info("📧 SOURCE: Found %d new emails in %s@%s:%s above UID %d",
+                        len(ids), self.cfg.user1, self.cfg.host1, self.cfg.folder, self.last_uid)
+            return len(ids)
+        except Exception as e:
+            logger.warning("Failed to search source by UID, falling back to folder totals: %s", e)
+            return None
 
-                result, message_ids = dest_conn.search(None, f'SINCE {date_str}')
-                if result == 'OK':
-                    ids = message_ids[0].split() if message_ids[0] else []
-                    dest_count = len(ids)
-                    logger.info(f"📧 DESTINATION: Found {dest_count} emails in {self.config['user2']}@{self.config['host2']}:{self.config['folder']} from last {self.config['date_filter_days']} days")
-                else:
-                    logger.warning(f"Failed to search destination emails: {result}")
+    def _count_destination(self):
+        """Count the messages in the destination folder with a single STATUS"""
+        try:
+            # Borrow a pooled APPEND connection rather than keeping one just for this
+            with self._borrow_dest() as conn:
+                result, data = conn.status(self.cfg.folder, '(MESSAGES)')
+            match = MESSAGES_RE.search(data[0]) if result == 'OK' else None
+            if match:
+                count = int(match.group(1))
+                logger.info("📧 DESTINATION: Found %d emails in %s@%s:%s", count, self.cfg.user2, self.cfg.host2, self.cfg.folder)
+                return count
+            logger.warning("Failed to get destination folder status: %s", result)
 
-            except Exception as e:
-                logger.error(f"Failed to check destination emails: {e}")
-            finally:
-                if dest_conn:
-                    try:
-                        dest_conn.close()
-                        dest_conn.logout()
-                    except:
-                        pass
+        except Exception as e:
+            logger.error("Failed to check destination emails: %s", e)
+        return 0
+
+    def check_existing_emails(self):
+        """Check for existing emails in both source and destination folders and log statistics"""
+        try:
+            # A checkpoint validated against UIDVALIDITY narrows the source
+            # scan to the delta; without one the folder totals are compared
+            if self.source_conn and self.last_uid is not None:
+                new_count = self._count_new_source()
+                if new_count is not None:
+                    if new_count == 0:
+                        logger.info("✅ No emails need to be synchronized - no new UIDs since the last sync")
+                    else:
+                        logger.info("🔄 Ready to synchronize %d emails", min(new_count, self.cfg.max_emails_per_sync))
+                    return new_count
+
+            # Both lookups are round-trip bound on different servers, so run them side by side
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                source_future = pool.submit(self._count_source) if self.source_conn else None
+                dest_future = pool.submit(self._count_destination)
+                source_count = source_future.result() if source_future else 0
+                dest_count = dest_future.result()
 
             # Calculate potential emails to move
             potential_to_move = max(0, source_count - dest_count) if source_count > 0 else 0
 
-            logger.info(f"📊 SYNC ANALYSIS:")
-            logger.info(f"   • Source emails: {source_count}")
-            logger.info(f"   • Destination emails: {dest_count}")
-            logger.info(f"   • Potentially need to sync: {potential_to_move} emails")
+            logger.info("📊 SYNC ANALYSIS: source=%d destination=%d need=%d", source_count, dest_count, potential_to_move)
 
-            if source_count > self.config['max_emails_per_sync']:
-                logger.warning(f"⚠️  Source email count ({source_count}) exceeds sync limit ({self.config['max_emails_per_sync']})")
-                logger.info(f"   Will sync only the most recent {self.config['max_emails_per_sync']} emails")
+            if source_count > self.cfg.max_emails_per_sync:
+                logger.warning("⚠️  Source email count (%d) exceeds sync limit (%d), will sync only the most recent %d emails",
+                               source_count, self.cfg.max_emails_per_sync, self.cfg.max_emails_per_sync)
 
             if potential_to_move == 0:
                 logger.info("✅ No emails need to be synchronized - folders appear to be in sync")
             elif potential_to_move > 0:
-                logger.info(f"🔄 Ready to synchronize {min(potential_to_move, self.config['max_emails_per_sync'])} emails")
+                logger.info("🔄 Ready to synchronize %d emails", min(potential_to_move, self.cfg.max_emails_per_sync))
 
             return source_count
 
         except Exception as e:
-            logger.error(f"Failed to check existing emails: {e}")
+            logger.error("Failed to check existing emails: %s", e)
             return 0
 
+    def parse_fetch_response(self, response):
+        """Turn an IMAPClient FETCH response into (uid, flags, internaldate, raw) tuples"""
+        messages = []
+        for uid in sorted(response):
+            data = response[uid]
+            # \Recent is session state and cannot be set by APPEND
+            flags = [f.decode() for f in data[b'FLAGS'] if f != b'\\Recent']
+            messages.append((uid, f"({' '.join(flags)})" if flags else None,
+                             data[b'INTERNALDATE'], data[b'BODY[]']))
+        return messages
+
+    def _fetch_batches(self, uids, batches, cancel):
+        """Producer: FETCH message bodies in FETCH_BATCH_SIZE chunks onto the bounded queue"""
+        try:
+            for i in range(0, len(uids), FETCH_BATCH_SIZE):
+                if cancel.is_set():
+                    break
+                response = self.source_conn.fetch(uids[i:i + FETCH_BATCH_SIZE],
+                                                  ['FLAGS', 'INTERNALDATE', 'BODY.PEEK[]'])
+                batches.put(self.parse_fetch_response(response))
+        except Exception as e:
+            batches.put(e)
+        finally:
+            batches.put(None)
+
+    def remove_from_source(self, uids):
+        """Delete transferred messages from the source folder (move mode)"""
+        self.source_conn.delete_messages(uids, silent=True)
+        # UID EXPUNGE removes only our messages, leaving anything else a
+        # client marked \Deleted untouched; plain EXPUNGE is the fallback
+        if self.source_conn.has_capability('UIDPLUS'):
+            self.source_conn.uid_expunge(uids)
+        else:
+            self.source_conn.expunge()
+
+    def transfer_new_messages(self):
+        """Copy messages above last_uid to the destination with pipelined UID FETCH + APPEND"""
+        start_time = time.time()
+
+        # Sizes first, so the safety limits apply before any body is downloaded
+        sizes = self.source_conn.fetch(f'{self.last_uid + 1}:*', ['RFC822.SIZE'])
+        if self._retry_uids:
+            sizes.update(self.source_conn.fetch(sorted(self._retry_uids), ['RFC822.SIZE']))
+            # Retries that have left the source folder need no further attempts
+            for uid in [uid for uid in self._retry_uids if uid not in sizes]:
+                del self._retry_uids[uid]
+        # "n:*" always matches the highest message, even when n is above it
+        candidates = sorted((uid, data[b'RFC822.SIZE'])
+                            for uid, data in sizes.items() if uid > self.last_uid or uid in self._retry_uids)
+
+        if not candidates:
+            logger.info("No new messages to transfer")
+            return True
+
+        uids = []
+        for uid, size in candidates[:self.cfg.max_emails_per_sync]:
+            if size > self.cfg.max_email_size:
+                logger.warning(f"Skipping UID {uid}: {size/1024/1024:.1f}MB exceeds size limit")
+                self._retry_uids.pop(uid, None)
+                continue
+            uids.append(uid)
+
+        transferred = []
+        failed = []
+        source_error = None
+        dest_error = None
+        if uids:
+            if not self._check_dest():
+                return False
+
+            # Overlap source FETCH with destination APPEND: the producer thread
+            # downloads the next batch while the pool uploads the current one
+            batches = queue.Queue(maxsize=FETCH_QUEUE_DEPTH)
+            cancel = threading.Event()
+            producer = threading.Thread(target=self._fetch_batches, args=(uids, batches, cancel), daemon=True)
+            producer.start()
+
+            with ThreadPoolExecutor(max_workers=APPEND_WORKERS) as pool:
+                for batch in iter(batches.get, None):
+                    if isinstance(batch, Exception):
+                        source_error = batch
+                        continue
+                    if dest_error:
+                        # Keep draining so the producer can finish
+                        continue
+
+                    futures = [(message[0], pool.submit(self._append_message, message)) for message in batch]
+                    for uid, future in futures:
+                        try:
+                            future.result()
+                            transferred.append(uid)
+                        except Exception as e:
+                            failed.append(uid)
+                            dest_error = dest_error or e
+                    if dest_error:
+                        cancel.set()
+            producer.join()
+
+        # Checkpoint before touching the source, so a failed removal can never
+        # make the next sync copy these messages again
+        if source_error or dest_error:
+            # Never copy the already appended messages twice; anything that
+            # failed below this UID is retried from _retry_uids
+            if transferred:
+                self.last_uid = max(self.last_uid, max(transferred))
+        else:
+            self.last_uid = max(self.last_uid, candidates[min(len(candidates), self.cfg.max_emails_per_sync) - 1][0])
+
+        for uid in transferred:
+            self._retry_uids.pop(uid, None)
+        for uid in failed:
+            # Failures above the checkpoint are fetched again anyway
+            if uid > self.last_uid:
+                continue
+            attempts = self._retry_uids.get(uid, 0) + 1
+            if attempts >= MAX_APPEND_ATTEMPTS:
+                self._retry_uids.pop(uid, None)
+                logger.warning(f"Giving up on UID {uid}, leaving it to the next imapsync reconcile")
+            else:
+                self._retry_uids[uid] = attempts
+        self.save_checkpoint()
+
+        if self.cfg.move and transferred and not source_error:
+            try:
+                self.remove_from_source(transferred)
+            except Exception as e:
+                # Copied and checkpointed; the --delete1 reconcile removes them later
+                logger.warning(f"Failed to remove {len(transferred)} copied emails from source: {e}")
+
+        if source_error:
+            raise source_error
+        if dest_error:
+            logger.error(f"Transfer stopped after {len(transferred)} emails: {dest_error}")
+            self.update_health_file("unhealthy")
+            return False
+
+        duration = time.time() - start_time
+        logger.info(f"✅ Transferred {len(transferred)} new emails in {duration:.1f}s")
+        self.update_health_file("healthy")
+        return True
+
+    def sync_new_messages(self):
+        """Fast path for IDLE wakeups; falls back to imapsync if the FETCH response cannot be parsed"""
+        if self.last_uid is None:
+            return self.sync_emails()
+
+        try:
+            with self.sync_lock:
+                return self.transfer_new_messages()
+        except (ProtocolError, KeyError) as e:
+            logger.warning(f"Could not parse FETCH response ({e}), falling back to imapsync")
+            return self.sync_emails()
+
+    def _run_imapsync(self, cmd, timeout):
+        """Run imapsync, streaming its output; returns (returncode, stats, last output lines)"""
+        # Stream the output line by line instead of buffering all of it in memory
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                bufsize=1, text=True)
+        self._imapsync_proc = proc
+        # proc.wait(timeout) cannot interrupt a blocked read, so a timer kills the process instead
+        watchdog = threading.Timer(timeout, proc.kill)
+        watchdog.start()
+
+        stats = {}
+        tail = collections.deque(maxlen=IMAPSYNC_TAIL_LINES)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        try:
+            for line in proc.stdout:
+                if debug:
+                    logger.debug(line.rstrip())
+                tail.append(line)
+                for pattern, stat_type in _STAT_PATTERNS:
+                    if stat_type not in stats:
+                        match = pattern.search(line)
+                        if match:
+                            stats[stat_type] = int(match.group(1))
+            returncode = proc.wait()
+        finally:
+            watchdog.cancel()
+            self._imapsync_proc = None
+
+        if returncode == -signal.SIGKILL:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return returncode, stats, ''.join(tail)
+
     def sync_emails(self):
         """Perform email synchronization using imapsync with safety limits"""
         with self.sync_lock:
             start_time = time.time()
+            self.last_reconcile = time.time()
             logger.info("Starting email synchronization...")
-            logger.info(f"Source: {self.config['user1']}@{self.config['host1']}:{self.config['folder']}")
-            logger.info(f"Destination: {self.config['user2']}@{self.config['host2']}:{self.config['folder']}")
+            logger.info("Source: %s@%s:%s", self.cfg.user1, self.cfg.host1, self.cfg.folder)
+            logger.info("Destination: %s@%s:%s", self.cfg.user2, self.cfg.host2, self.cfg.folder)
 
             # Check existing emails first
             email_count = self.check_existing_emails()
 
-            # Build imapsync command with safety limits
-            cmd = [
-                'imapsync',
-                '--host1', self.config['host1'],
-                '--user1', self.config['user1'],
-                '--password1', self.config['password1'],
-                '--host2', self.config['host2'],
-                '--user2', self.config['user2'],
-                '--password2', self.config['password2'],
-                '--folder', self.config['folder'],
-                '--useuid', '--automap', '--fastio1', '--fastio2',
-                '--syncinternaldates', '--skipcrossduplicates',
-                '--maxage', str(self.config['date_filter_days']),
-                '--maxmessages', str(self.config['max_emails_per_sync']),
-                '--maxsize', str(self.config['max_email_size'])
-                # Note: --sleep option removed as it's not supported in this version of imapsync
+            # Only the safety limits vary per run; everything else was built at startup
+            cmd = self._base_imapsync_cmd + [
+                '--maxage', str(self.cfg.date_filter_days),
+                '--maxmessages', str(self.cfg.max_emails_per_sync),
             ]
 
-            # Add SSL options
-            if self.config['ssl1']:
-                cmd.append('--ssl1')
-            if self.config['ssl2']:
-                cmd.append('--ssl2')
-
-            # Add move mode if enabled
-            if self.config['move']:
-                cmd.append('--delete1')
-
-            logger.info(f"Sync limits: {self.config['date_filter_days']} days, {self.config['max_emails_per_sync']} emails max, {self.config['max_email_size']/1024/1024:.1f}MB per email")
+            logger.info("Sync limits: %d days, %d emails max, %.1fMB per email",
+                        self.cfg.date_filter_days, self.cfg.max_emails_per_sync, self.cfg.max_email_size / 1024 / 1024)
 
             try:
+                # Read before imapsync starts, so mail arriving during the run stays above the checkpoint
+                uidnext = None
+                if self.source_conn:
+                    uidnext = self.source_conn.folder_status(self.cfg.folder, ['UIDNEXT'])[b'UIDNEXT']
+
                 logger.info("🔄 Starting imapsync process...")
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)  # 10 minute timeout
+                returncode, stats, tail = self._run_imapsync(cmd, IMAPSYNC_TIMEOUT)
                 duration = time.time() - start_time
 
-                if result.returncode == 0:
-                    # Parse output for detailed statistics
-                    output = result.stdout + result.stderr
-
-                    # Extract comprehensive statistics from imapsync output
-                    import re
-
-                    # Look for various patterns in imapsync output
-                    transferred = 0
-                    skipped = 0
-                    errors = 0
-
-                    # Try different patterns that imapsync might use
-                    patterns = [
-                        (r'Transferred:\s*(\d+)', 'transferred'),
-                        (r'Skipped:\s*(\d+)', 'skipped'),
-                        (r'Errors:\s*(\d+)', 'errors'),
-                        (r'(\d+)\s+messages\s+transferred', 'transferred'),
-                        (r'(\d+)\s+messages\s+skipped', 'skipped'),
-                        (r'(\d+)\s+messages\s+copied', 'transferred'),
-                        (r'Total\s+bytes\s+transferred:\s*(\d+)', 'bytes'),
-                    ]
-
-                    stats = {}
-                    for pattern, stat_type in patterns:
-                        match = re.search(pattern, output, re.IGNORECASE)
-                        if match:
-                            stats[stat_type] = int(match.group(1))
-
+                if returncode == 0:
+                    # Statistics collected while streaming the output
                     transferred = stats.get('transferred', 0)
                     skipped = stats.get('skipped', 0)
                     errors = stats.get('errors', 0)
                     bytes_transferred = stats.get('bytes', 0)
 
-                    logger.info(f"✅ Synchronization completed successfully in {duration:.1f}s")
-                    logger.info(f"📊 SYNC RESULTS:")
-                    logger.info(f"   • Messages transferred: {transferred}")
-                    logger.info(f"   • Messages skipped: {skipped}")
+                    logger.info("✅ Synchronization completed successfully in %.1fs", duration)
+                    logger.info("📊 SYNC RESULTS: transferred=%d skipped=%d data=%.1fMB",
+                                transferred, skipped, bytes_transferred / 1024 / 1024)
                     if errors > 0:
-                        logger.warning(f"   • Errors encountered: {errors}")
-                    if bytes_transferred > 0:
-                        logger.info(f"   • Data transferred: {bytes_transferred/1024/1024:.1f} MB")
+                        logger.warning("   • Errors encountered: %d", errors)
 
                     if transferred > 0:
-                        logger.info(f"🎉 Successfully moved {transferred} emails!")
+                        logger.info("🎉 Successfully moved %d emails!", transferred)
                     elif skipped > 0:
                         logger.info("ℹ️  All emails were already synchronized (skipped)")
                     else:
                         logger.info("ℹ️  No emails needed to be moved")
 
-                    # Log a sample of the imapsync output for debugging
-                    if output.strip():
-                        logger.debug(f"Imapsync output sample: {output[:200]}...")
+                    # imapsync may have copied messages the fast path has not seen yet,
+                    # and has copied anything still waiting for a retry
+                    self._retry_uids.clear()
+                    if uidnext is not None:
+                        self.update_last_uid(uidnext)
 
                     self.update_health_file("healthy")
                     return True
                 else:
-                    logger.error(f"❌ Synchronization failed after {duration:.1f}s with exit code: {result.returncode}")
-                    logger.error(f"Error output: {result.stderr[:500]}")  # Limit error output
-
-                    # Log stdout as well in case it contains useful info
-                    if result.stdout.strip():
-                        logger.info(f"Stdout: {result.stdout[:500]}")
+                    logger.error("❌ Synchronization failed after %.1fs with exit code: %d", duration, returncode)
+                    # Only the last lines are kept, which is where imapsync reports errors
+                    logger.error("Error output:\n%s", tail)
 
                     self.update_health_file("unhealthy")
                     return False
 
             except subprocess.TimeoutExpired:
                 duration = time.time() - start_time
-                logger.error(f"Synchronization timed out after {duration:.1f}s")
+                logger.error("Synchronization timed out after %.1fs", duration)
                 self.update_health_file("unhealthy")
                 return False
             except Exception as e:
                 duration = time.time() - start_time
-                logger.error(f"Synchronization error after {duration:.1f}s: {e}")
+                logger.error("Synchronization error after %.1fs: %s", duration, e)
                 self.update_health_file("unhealthy")
                 return False
     
     def idle_loop(self):
-        """Main IDLE loop - keeps connection open and listens for changes"""
+        """Main IDLE loop - keeps its own connection listening and flags new mail for the sync worker"""
         while self.running:
             try:
-                if not self.source_conn:
-                    if not self.connect_source():
+                if not self.idle_conn:
+                    if not self.connect_idle():
                         self.update_health_file("unhealthy")
-                        time.sleep(30)
+                        self._stop_event.wait(30)
                         continue
 
                 logger.info("📡 IDLE mode activated - listening for new emails...")
                 self.update_health_file("healthy")
 
                 # Start IDLE
-                self.source_conn.send(b'IDLE\r\n')
-
-                # Wait for responses with timeout
-                start_time = time.time()
-                last_health_update = time.time()
-
-                while self.running and (time.time() - start_time) < self.config['idle_timeout']:
-                    try:
-                        # Update health file every 30 seconds
-                        if time.time() - last_health_update > 30:
-                            self.update_health_file("healthy")
-                            last_health_update = time.time()
-
-                        # Check for IDLE responses (non-blocking)
-                        response = self.source_conn.response('IDLE')
-                        if response[0] == 'OK':
-                            # New messages arrived
-                            logger.info("New messages detected, triggering sync...")
-
-                            # Exit IDLE mode
-                            self.source_conn.send(b'DONE\r\n')
-
-                            # Perform synchronization
-                            self.sync_emails()
-
-                            # Restart IDLE
-                            break
-                    except imaplib.IMAP4.abort:
-                        logger.warning("IMAP connection aborted, reconnecting...")
-                        self.source_conn = None
-                        self.update_health_file("unhealthy")
+                self.idle_conn.idle()
+
+                # Block on the socket until the server pushes data or the deadline passes
+                deadline = time.monotonic() + self.cfg.idle_timeout
+
+                while self.running:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
                         break
-                    except Exception as e:
-                        logger.debug(f"IDLE check: {e}")
-                        time.sleep(1)
+                    # Wake up at least every 30 seconds to refresh the health file
+                    responses = self.idle_conn.idle_check(timeout=min(30, remaining))
+                    self.update_health_file("healthy")
+
+                    # Stay in IDLE: the sync runs on the worker, so later pushes are not missed
+                    if any(len(r) > 1 and r[1] in (b'EXISTS', b'EXPUNGE') for r in responses):
+                        logger.info("New messages detected, triggering sync...")
+                        self._dirty.set()
+
+                # Exit IDLE mode before issuing any other command
+                self.idle_conn.idle_done()
 
                 # Periodic sync even without new messages (every 29 minutes)
-                if self.running and (time.time() - start_time) >= self.config['idle_timeout']:
-                    logger.info("IDLE timeout reached, performing periodic sync...")
-                    try:
-                        self.source_conn.send(b'DONE\r\n')
-                    except:
-                        pass
-                    self.sync_emails()
-                    # Reconnect to refresh IDLE
-                    self.source_conn = None
+                if self.running:
+                    logger.info("IDLE timeout reached, triggering periodic sync...")
+                    self._dirty.set()
+
+                    # Leaving IDLE is enough to satisfy the server's IDLE limit; a NOOP
+                    # keeps the session alive and IDLE restarts on the same connection
+                    self.idle_conn.noop()
 
+            except IMAPClient.AbortError:
+                logger.warning("IMAP connection aborted, reconnecting...")
+                self.idle_conn = None
+                self.update_health_file("unhealthy")
             except Exception as e:
                 logger.error(f"IDLE loop error: {e}")
+                self.idle_conn = None
+                self.update_health_file("unhealthy")
+                self._stop_event.wait(30)
+
+    def sync_loop(self):
+        """Sync worker - runs one sync per batch of IDLE wakeups on the sync connection"""
+        while self.running:
+            self._dirty.wait()
+            self._dirty.clear()
+            if not self.running:
+                break
+
+            try:
+                if not self.source_conn:
+                    if not self.connect_source():
+                        self.update_health_file("unhealthy")
+                        self._dirty.set()  # retry the pending sync
+                        self._stop_event.wait(30)
+                        continue
+
+                # Folder was recreated or renumbered: fall back to a full reconcile
+                if self.last_uid is None:
+                    self.sync_emails()
+                else:
+                    # Transfer only the messages that arrived since the last sync
+                    self.sync_new_messages()
+
+                    # Rare full reconcile to catch anything the fast path missed
+                    if time.time() - self.last_reconcile >= self.cfg.reconcile_interval:
+                        self.sync_emails()
+
+            except IMAPClient.AbortError:
+                logger.warning("IMAP sync connection aborted, reconnecting...")
                 self.source_conn = None
                 self.update_health_file("unhealthy")
-                time.sleep(30)
-    
+                self._dirty.set()
+            except Exception as e:
+                logger.error(f"Sync worker error: {e}")
+                self.source_conn = None
+                self.update_health_file("unhealthy")
+                self._dirty.set()
+                self._stop_event.wait(30)
+
     def start(self):
         """Start the IDLE synchronization service"""
         logger.info("Starting IMAP IDLE synchronization service...")
         self.running = True
 
-        # Initial sync
+        # Initial sync: only new messages when a valid checkpoint exists
         logger.info("🔄 Performing initial synchronization...")
-        sync_success = self.sync_emails()
+        self.connect_source()
+        if self.last_uid is not None:
+            self.last_reconcile = time.time()
+            sync_success = self.sync_new_messages()
+        else:
+            sync_success = self.sync_emails()
+
+        # A signal during the initial sync stops the service before any thread starts
+        if self._stop_event.is_set():
+            self.stop()
+            return
 
         # Log summary before starting IDLE mode
         if sync_success:
@@ -371,38 +863,69 @@ class IMAPIdleSync:
         logger.info("   • New emails will be detected and synced automatically")
         logger.info("   • System is ready for real-time email synchronization")
 
-        # Start IDLE thread
+        # IDLE listens on its own connection; syncs run on the worker thread
+        self.sync_thread = threading.Thread(target=self.sync_loop, daemon=True)
+        self.sync_thread.start()
         self.idle_thread = threading.Thread(target=self.idle_loop, daemon=True)
         self.idle_thread.start()
 
-        # Keep main thread alive
+        # Sleep off-CPU until a signal handler or stop() sets the event
         try:
-            while self.running:
-                time.sleep(1)
+            self._stop_event.wait()
         except KeyboardInterrupt:
+            pass
+        finally:
             self.stop()
     
+    def request_stop(self):
+        """Ask the service to stop; safe to call from a signal handler"""
+        self.running = False
+        self._stop_event.set()
+        # A running imapsync would otherwise hold up shutdown for up to IMAPSYNC_TIMEOUT
+        proc = self._imapsync_proc
+        if proc:
+            proc.terminate()
+
     def stop(self):
         """Stop the synchronization service"""
         logger.info("Stopping IMAP IDLE synchronization service...")
-        self.running = False
+        self.request_stop()
+        self._dirty.set()  # wake the sync worker so it can exit
         
-        if self.source_conn:
+        if self.idle_conn:
             try:
-                self.source_conn.send(b'DONE\r\n')
-                self.source_conn.logout()
+                self.idle_conn.idle_done()
+                self.idle_conn.logout()
             except:
                 pass
-        
+
         if self.idle_thread:
             self.idle_thread.join(timeout=5)
+        if self.sync_thread:
+            self.sync_thread.join(timeout=5)
+
+        if self.source_conn:
+            try:
+                self.source_conn.logout()
+            except:
+                pass
+
+        while not self._dest_pool.empty():
+            conn, _ = self._dest_pool.get_nowait()
+            if conn:
+                try:
+                    conn.logout()
+                except:
+                    pass
 
 def signal_handler(signum, frame):
     """Handle shutdown signals"""
     logger.info(f"Received signal {signum}, shutting down...")
     if 'sync_service' in globals():
-        sync_service.stop()
-    sys.exit(0)
+        # start() wakes up and runs the cleanup in the main thread
+        sync_service.request_stop()
+    else:
+        sys.exit(0)
 
 if __name__ == "__main__":
     # Set up signal handlers
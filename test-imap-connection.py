@@ -5,21 +5,47 @@ Tests IMAP connections, IDLE support, and basic functionality
 """
 
 import imaplib
+import base64
+import binascii
+import re
 import ssl
 import sys
+import select
 import os
 import time
 import argparse
 from datetime import datetime
 
-# Colors for output
+# Colors for output, only on a terminal and unless NO_COLOR is set (https://no-color.org)
+_USE_COLOR = sys.stdout.isatty() and not os.getenv('NO_COLOR')
+
 class Colors:
-    GREEN = '\033[92m'
-    RED = '\033[91m'
-    YELLOW = '\033[93m'
-    BLUE = '\033[94m'
-    BOLD = '\033[1m'
-    END = '\033[0m'
+    GREEN = '\033[92m' if _USE_COLOR else ''
+    RED = '\033[91m' if _USE_COLOR else ''
+    YELLOW = '\033[93m' if _USE_COLOR else ''
+    BLUE = '\033[94m' if _USE_COLOR else ''
+    BOLD = '\033[1m' if _USE_COLOR else ''
+    END = '\033[0m' if _USE_COLOR else ''
+
+# Shifted sequences of IMAP modified UTF-7 (RFC 3501 section 5.1.3)
+UTF7_SHIFT_RE = re.compile(r'&([^-]*)-')
+
+def _expand_utf7(match):
+    encoded = match.group(1)
+    if not encoded:
+        return '&'
+    padded = encoded.replace(',', '/') + '=' * (-len(encoded) % 4)
+    try:
+        return base64.b64decode(padded).decode('utf-16-be', 'replace')
+    except binascii.Error:
+        # Malformed shift sequence: show it as sent rather than failing the listing
+        return match.group(0)
+
+def decode_folder(raw):
+    """Decode a LIST response line, rendering non-ASCII folder names"""
+    if isinstance(raw, tuple):  # Folder name sent as a literal
+        raw = b''.join(raw)
+    return UTF7_SHIFT_RE.sub(_expand_utf7, raw.decode('ascii', 'replace'))
 
 def print_success(msg):
     print(f"{Colors.GREEN}✓ {msg}{Colors.END}")
@@ -94,8 +120,7 @@ class IMAPTester:
             result, folders = self.connection.list()
             if result == 'OK':
                 print_success(f"Found {len(folders)} folders:")
-                for folder in folders[:10]:  # Show first 10 folders
-                    folder_name = folder.decode('utf-8') if isinstance(folder, bytes) else str(folder)
+                for folder_name in map(decode_folder, folders[:10]):  # Show first 10 folders
                     print(f"  - {folder_name}")
                 if len(folders) > 10:
                     print(f"  ... and {len(folders) - 10} more folders")
@@ -188,12 +213,24 @@ class IMAPTester:
                     recent_ids = ids[-3:] if len(ids) >= 3 else ids
                     print_success(f"Found {len(ids)} total messages, checking last {len(recent_ids)}")
                     
-                    for msg_id in recent_ids:
-                        result, msg_data = self.connection.fetch(msg_id, '(ENVELOPE)')
-                        if result == 'OK':
-                            print_info(f"Message {msg_id.decode()}: {len(msg_data[0])} bytes")
-                        else:
-                            print_warning(f"Failed to fetch message {msg_id.decode()}")
+                    # One FETCH for the whole sequence set instead of one round trip per message
+                    result, msg_data = self.connection.fetch(b','.join(recent_ids), '(ENVELOPE)')
+                    if result == 'OK':
+                        # Each response starts with its sequence number; literals arrive as
+                        # (prefix, literal) tuples followed by the rest of the same response
+                        sizes = {}
+                        msg_id = None
+                        for item in msg_data:
+                            part = b''.join(item) if isinstance(item, tuple) else item
+                            if part[:1].isdigit():
+                                msg_id = part.split(b' ', 1)[0].decode()
+                                sizes[msg_id] = 0
+                            if msg_id:
+                                sizes[msg_id] += len(part)
+                        for msg_id, size in sizes.items():
+                            print_info(f"Message {msg_id}: {size} bytes")
+                    else:
+                        print_warning(f"Failed to fetch messages {b','.join(recent_ids).decode()}")
                     
                     return True
                 else:
@@ -217,6 +254,9 @@ class IMAPTester:
             
         try:
             print_info(f"Testing connection stability for {duration} seconds...")
+            if 'IDLE' in self.connection.capabilities:
+                return self._idle_stability(duration)
+
             start_time = time.time()
             
             while time.time() - start_time < duration:
@@ -237,6 +277,44 @@ class IMAPTester:
         except Exception as e:
             print_error(f"Connection stability test failed: {e}")
             return False
+
+    def _idle_stability(self, duration):
+        """Hold one IDLE for the whole duration; the connection is stable if DONE completes with OK"""
+        tag = self.connection._new_tag()
+        self.connection.send(tag + b' IDLE\r\n')
+        line = self.connection.readline()
+        if not line.startswith(b'+'):
+            print_error(f"Server refused IDLE: {line.strip().decode(errors='replace')}")
+            return False
+
+        start_time = time.time()
+        deadline = start_time + duration
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # Sleep in the kernel until the server pushes something; wake every 5s for progress
+            readable, _, _ = select.select([self.connection.sock], [], [], min(5, remaining))
+            if readable:
+                line = self.connection.readline()
+                if not line or line.startswith(b'* BYE'):
+                    print()
+                    print_error(f"Connection lost: {line.strip().decode(errors='replace') or 'closed by server'}")
+                    return False
+            elapsed = int(time.time() - start_time)
+            print(f"\r  Connection stable for {elapsed}s...", end='', flush=True)
+
+        print()  # New line
+        self.connection.send(b'DONE\r\n')
+        line = self.connection.readline()
+        while line and not line.startswith(tag):
+            line = self.connection.readline()
+
+        if line.split()[1:2] != [b'OK']:
+            print_error(f"IDLE did not complete: {line.strip().decode(errors='replace') or 'connection closed'}")
+            return False
+        print_success(f"Connection remained stable for {duration} seconds (single IDLE)")
+        return True
     
     def close_connection(self):
         """Close IMAP connection"""
@@ -262,20 +340,21 @@ class IMAPTester:
             ("Connection Stability", lambda: self.test_connection_stability(stability_duration))
         ]
         
-        results = {}
+        results = []
         for test_name, test_func in tests:
             try:
-                results[test_name] = test_func()
+                results.append((test_name, bool(test_func())))
             except Exception as e:
                 print_error(f"Test '{test_name}' crashed: {e}")
-                results[test_name] = False
+                results.append((test_name, False))
         
         # Summary
         print_header("Test Results Summary")
-        passed = sum(1 for result in results.values() if result)
+        passed = 0
         total = len(results)
         
-        for test_name, result in results.items():
+        for test_name, result in results:
+            passed += result
             status = "PASS" if result else "FAIL"
             color = Colors.GREEN if result else Colors.RED
             print(f"{color}{status:4}{Colors.END} - {test_name}")
@@ -314,9 +393,7 @@ def main():
     results = tester.run_all_tests(args.stability_duration)
     
     # Exit with appropriate code
-    passed = sum(1 for result in results.values() if result)
-    total = len(results)
-    sys.exit(0 if passed == total else 1)
+    sys.exit(0 if all(result for _, result in results) else 1)
 
 if __name__ == "__main__":
     main()